@@ -0,0 +1,70 @@
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionControl:
+    """Cap the number of pipelines running at the same time.
+
+    Up to max_in_flight requests run, up to max_queue more wait at most
+    queue_timeout seconds for a slot and everything beyond that is shed so
+    the caller can answer with a fast 503 instead of timing out later."""
+
+    def __init__(
+        self,
+        max_in_flight: int = config.admission_max_in_flight,
+        max_queue: int = config.admission_max_queue,
+        queue_timeout: float = config.admission_queue_timeout,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def acquire(self) -> bool:
+        """Return True if the request may run, it must then call release()"""
+        if self._slots.acquire(blocking=False):
+            return self._admit()
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                logger.warning("Shedding request, the wait queue is full")
+                return False
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.shed += 1
+                logger.warning("Shedding request, no slot became free in time")
+                return False
+        return self._admit()
+
+    def _admit(self) -> bool:
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
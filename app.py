@@ -1,12 +1,38 @@
+import hmac
 import logging
-from flask import Flask, render_template, request, redirect, url_for, abort
+from flask import (
+    Flask,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    abort,
+    jsonify,
+    make_response,
+)
 import config
+from admission import AdmissionControl
+from cache import TTLCache
+from extractors import get_extractors
+from invalidation import ChangeFeedConsumer, cache_index
+from profiling import SamplingProfiler
+from sparql import get_sparql
+from upstream import get_clients
 from wpf import WPF
 
 logging.basicConfig(level=config.loglevel)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Set up the pooled upstream connections once for all requests
+clients = get_clients()
+sparql = get_sparql()
+extractors = get_extractors()
+admission = AdmissionControl()
+result_cache = TTLCache(maxsize=config.result_cache_size, ttl=config.result_cache_ttl)
+change_feed = ChangeFeedConsumer(cache_index) if config.change_feed_enabled else None
+if change_feed:
+    change_feed.start()
 
 
 @app.errorhandler(500)
@@ -20,6 +46,50 @@ def index():
     return render_template("index.html")
 
 
+def profiling_requested() -> bool:
+    """Profile when enabled in config and the request carries the token"""
+    # Every profile is written to disk so a token is always required
+    if not config.profiling_enabled or not config.profiling_token:
+        return False
+    token = request.args.get("profile") or request.headers.get("X-Profile-Token")
+    if not token:
+        return False
+    return hmac.compare_digest(token, config.profiling_token)
+
+
+def run_search(reference_text: str):
+    # Cached results need no upstream calls so they skip admission control
+    wpf = result_cache.get(reference_text)
+    if wpf is None:
+        if not admission.acquire():
+            return (
+                render_template("503.html", retry_after=config.admission_retry_after),
+                503,
+                {"Retry-After": str(config.admission_retry_after)},
+            )
+        try:
+            wpf = WPF(reference_text=reference_text)  # Create an instance of WPF
+            wpf.run()
+        finally:
+            admission.release()
+        if not wpf.status:
+            abort(500)
+        if wpf.status.startswith("Success"):
+            result_cache.set(reference_text, wpf)
+            # Without the change feed nothing reads the index
+            if change_feed:
+                cache_index.track(
+                    result_cache,
+                    reference_text,
+                    entity_ids=wpf.article_qids,
+                    volumes=[(wpf.journal_qid, wpf.volume)] if wpf.journal_qid else [],
+                )
+    logger.info(wpf.status)
+    # print(wpf.query_result)
+    # We pass the whole object here to make life easier
+    return render_template("results.html", wpf=wpf)
+
+
 @app.route("/search", methods=["GET", "POST"])
 def search():
     reference_text = (
@@ -29,16 +99,31 @@ def search():
     )
     if reference_text:
         reference_text = reference_text.strip()
-        wpf = WPF(reference_text=reference_text)  # Create an instance of WPF
-        wpf.run()
-        if not wpf.status:
-            abort(500)
-        logger.info(wpf.status)
-        # print(wpf.query_result)
-        # We pass the whole object here to make life easier
-        return render_template("results.html", wpf=wpf)
+        if not profiling_requested():
+            return run_search(reference_text)
+        with SamplingProfiler() as profiler:
+            response = make_response(run_search(reference_text))
+        response.headers["Server-Timing"] = profiler.server_timing
+        response.headers["X-Profile-File"] = profiler.save()
+        return response
     return redirect(url_for("index"))
 
 
+@app.route("/status", methods=["GET"])
+def status():
+    return jsonify(
+        {
+            "upstream": clients.stats(),
+            "sparql": sparql.to_dict(),
+            "extractors": extractors.to_dict(),
+            "admission": admission.stats(),
+            "result_cache": result_cache.stats(),
+            "invalidation": (
+                change_feed.stats() if change_feed else cache_index.stats()
+            ),
+        }
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,3 +1,90 @@
 import logging
 
 loglevel = logging.DEBUG
+
+user_agent = (
+    "WikidataPaperFinder/0.1.0 (https://github.com/dpriskorn/WikidataPaperFinder)"
+)
+
+# Pooled keep-alive connections to upstream hosts (Wikidata API, WDQS, DuckDuckGo)
+upstream_pool_connections = 10  # number of hosts to keep a pool for
+upstream_pool_maxsize = 20  # connections kept alive per host
+upstream_connect_timeout = 10  # seconds
+upstream_read_timeout = 90  # seconds, WDQS itself times out after 60
+
+# SPARQL endpoints, the first one is the primary. Add mirrors or a local
+# WDQS stand-in to enable hedging of slow queries to the fastest other one.
+sparql_endpoints = ["https://query.wikidata.org/sparql"]
+sparql_hedge_percentile = 0.95  # hedge when the primary is slower than this
+sparql_hedge_initial_delay = 5.0  # seconds, used until we have enough samples
+sparql_hedge_min_delay = 0.5  # seconds
+sparql_hedge_max_delay = 30.0  # seconds
+sparql_hedge_min_samples = 20
+sparql_latency_window = 200  # latencies kept per endpoint
+# A losing hedged request cannot be aborted, it keeps one worker busy until
+# it answers or hits upstream_read_timeout (90 s). Size the pool for the
+# expected number of slow queries running at the same time plus the hedges.
+sparql_max_workers = 20
+# Retries on the last endpoint left for 429/503, connection errors and
+# timeouts, waiting Retry-After seconds when WDQS sends it
+sparql_max_retries = 3
+sparql_retry_after = 5.0  # seconds, used without a Retry-After header
+sparql_retry_max_delay = 60.0  # seconds
+
+# Backends that extract the reference details, in order of preference.
+# "ddgs:<model>" uses DuckDuckGo AI chat, "openai:<model>" the OpenAI compatible
+# endpoint below and "rules" the regular expression parser.
+extractor_backends = ["ddgs:gpt-4o-mini", "ddgs:claude-3-haiku", "rules"]
+extractor_mode = "fallback"  # or "race" to run the two preferred at the same time
+extractor_timeout = 30  # seconds per backend
+extractor_min_calls = 10  # calls before the order follows the recorded stats
+extractor_max_workers = 20
+openai_base_url = ""  # e.g. "http://localhost:8080/v1" for a locally hosted model
+openai_model = ""
+openai_api_key = ""
+
+# Admission control for /search, requests answered from the result cache
+# are not counted
+admission_max_in_flight = 8  # pipelines running at the same time
+admission_max_queue = 16  # requests waiting for a free slot
+admission_queue_timeout = 2.0  # seconds a request waits before it is shed
+admission_retry_after = 10  # seconds, sent in the Retry-After header
+
+# Successful results are cached by reference text
+result_cache_size = 1000
+result_cache_ttl = 3600  # seconds, can be much longer with change_feed_enabled
+
+# On-demand profiling of /search with ?profile=<token> or the X-Profile-Token
+# header. Folded stacks for flamegraph tools are written to profiling_dir.
+profiling_enabled = False
+profiling_token = ""  # required, profiling stays off while this is empty
+profiling_interval = 0.005  # seconds between samples
+profiling_dir = "profiles"
+
+# Journal QIDs found by CirrusSearch are cached by journal name
+journal_cache_size = 10000
+journal_cache_ttl = 24 * 3600  # seconds, can be much longer with change_feed_enabled
+
+# Whole volumes are listed once and cached with the title and author vectors
+# of their articles, references to a cached volume only pick their page
+# window and score it instead of sending their own query
+volume_cache_size = 100
+volume_cache_ttl = 3600  # seconds, can be much longer with change_feed_enabled
+
+# Invalidate cached results and journals when they are edited on Wikidata,
+# this allows long cache TTLs. The source is an EventStreams URL, a file with
+# recorded events or tcp://host:port for testing.
+change_feed_enabled = False
+change_feed_source = "https://stream.wikimedia.org/v2/stream/recentchange"
+change_feed_wiki = "wikidatawiki"
+# While any volume is tracked, edited items are checked in batches with one
+# WDQS query that only returns the ones in a tracked volume. Wikidata sees
+# roughly 10 to 20 item edits per second, so with these values every app
+# process sends one query with up to 500 QIDs every 25 to 30 seconds. WDQS
+# also lags the edits by a few seconds to minutes, waiting helps with that.
+change_feed_batch_size = 500  # items per query
+change_feed_batch_interval = 30.0  # seconds
+change_feed_reconnect_delay = 5.0  # seconds
+change_feed_read_timeout = 60  # seconds without data before reconnecting
+change_feed_prune_interval = 600.0  # seconds between dropping evicted entries
+change_feed_max_pending = 5000  # unchecked items before all volumes are dropped
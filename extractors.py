@@ -0,0 +1,299 @@
+import json
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+from profiling import submit
+from upstream import UpstreamClients, get_clients
+
+logger = logging.getLogger(__name__)
+
+required_fields = ["journal", "year", "volume", "pages"]
+
+
+def build_prompt(reference_text: str) -> str:
+    return (
+        "Please extract the title, authors, journal, year, volume, and page number from this reference in a paper "
+        "and give me the result as an one line unformatted JSON object with the keys ['title', 'authors', 'journal', 'year', 'volume', 'pages'], "
+        "don't format as time, just return strings or empty strings. Copy the journal name verbatim, only output the JSON: "
+        f'"{reference_text}"'
+    )
+
+
+def parse_response(text: str) -> dict:
+    """Parse the JSON object the model answered with"""
+    text = text.replace("json", "").strip().strip("`").strip()
+    logger.debug(text)
+    try:
+        # Attempt to parse the JSON response
+        response = json.loads(text)
+    except json.JSONDecodeError:
+        return {"error": "Failed to parse JSON from response"}
+    if not isinstance(response, dict):
+        return {"error": "Failed to parse JSON from response"}
+    return response
+
+
+def is_valid(response: dict) -> bool:
+    """Check if the required fields are present in the data."""
+    return all(field in response for field in required_fields)
+
+
+class Extractor(ABC):
+    """Extract the reference details from the reference text"""
+
+    name: str = ""
+    # Fallback only extractors are never moved in front of the others
+    fallback_only: bool = False
+
+    @abstractmethod
+    def extract(self, reference_text: str) -> dict:
+        """Return the extracted fields or a dict with an 'error' key"""
+
+
+class DDGSExtractor(Extractor):
+    """DuckDuckGo AI chat"""
+
+    def __init__(self, model: str = "gpt-4o-mini", clients: UpstreamClients = None):
+        self.model = model
+        self.name = f"ddgs:{model}"
+        self.clients = clients or get_clients()
+
+    def extract(self, reference_text: str) -> dict:
+        text = self.clients.ddgs.chat(
+            build_prompt(reference_text),
+            model=self.model,
+            timeout=config.extractor_timeout,
+        )
+        return parse_response(text)
+
+
+class OpenAIExtractor(Extractor):
+    """OpenAI compatible chat completions endpoint, e.g. a locally hosted model"""
+
+    def __init__(
+        self,
+        base_url: str = config.openai_base_url,
+        model: str = config.openai_model,
+        api_key: str = config.openai_api_key,
+        clients: UpstreamClients = None,
+    ):
+        if not base_url:
+            raise ValueError("openai_base_url is not set in config.py")
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.name = f"openai:{model}"
+        self.clients = clients or get_clients()
+
+    def extract(self, reference_text: str) -> dict:
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        response = self.clients.session.post(
+            f"{self.base_url}/chat/completions",
+            json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": build_prompt(reference_text)}],
+                "temperature": 0,
+            },
+            headers=headers,
+            timeout=config.extractor_timeout,
+        )
+        response.raise_for_status()
+        return parse_response(response.json()["choices"][0]["message"]["content"])
+
+
+class RuleBasedExtractor(Extractor):
+    """Parse the common '<authors> (<year>). <journal> <volume>, <pages>.' layouts
+    with regular expressions, no network needed"""
+
+    name = "rules"
+    fallback_only = True
+    year_pattern = re.compile(r"\(?\b(1[5-9]\d\d|20\d\d)\b\)?")
+    journal_pattern = re.compile(
+        r"(?P<journal>[A-Z][A-Za-z.&' ]*?[A-Za-z.])\s*,?\s*(?:vol\.?\s*)?"
+        r"(?P<volume>\d+)\s*(?:\(\d+\))?\s*[,:]\s*(?:pp?\.\s*)?"
+        r"(?P<pages>\d+(?:\s*[-–]\s*\d+)?)"
+    )
+
+    def extract(self, reference_text: str) -> dict:
+        year_match = self.year_pattern.search(reference_text)
+        if not year_match:
+            return {"error": "No year found in reference"}
+        # The journal, volume and pages follow the year in these layouts
+        rest = reference_text[year_match.end() :]
+        journal_match = self.journal_pattern.search(rest)
+        if not journal_match:
+            return {"error": "No journal, volume and pages found in reference"}
+        return {
+            "authors": reference_text[: year_match.start()].strip(" ,.("),
+            "journal": journal_match.group("journal").strip(),
+            "year": year_match.group(1),
+            "volume": journal_match.group("volume"),
+            "pages": re.sub(r"\s", "", journal_match.group("pages")),
+        }
+
+
+def build_extractor(spec: str) -> Extractor:
+    """Build an extractor from a 'backend' or 'backend:model' string"""
+    backend, _, model = spec.partition(":")
+    if backend == "ddgs":
+        return DDGSExtractor(model=model or "gpt-4o-mini")
+    if backend == "openai":
+        return OpenAIExtractor(model=model or config.openai_model)
+    if backend == "rules":
+        return RuleBasedExtractor()
+    raise ValueError(f"Unknown extractor backend '{backend}'")
+
+
+class ExtractorStats:
+    """Latency and validity of one backend"""
+
+    def __init__(self):
+        self.calls = 0
+        self.valid = 0
+        self.latency = 0.0  # exponential moving average in seconds
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, valid: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.valid += valid
+            if self.calls == 1:
+                self.latency = latency
+            else:
+                self.latency += 0.2 * (latency - self.latency)
+
+    @property
+    def validity(self) -> float:
+        return self.valid / self.calls if self.calls else 1.0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "valid": self.valid,
+            "validity": round(self.validity, 3),
+            "latency": round(self.latency, 3),
+        }
+
+
+class ExtractorPipeline:
+    """Run the extractors in order of preference.
+
+    In fallback mode the next backend is tried when one times out, fails or
+    answers with invalid data. In race mode the two preferred backends run at
+    the same time and the first valid answer wins, the rest are fallbacks.
+    Once a backend has enough calls the preference order follows the recorded
+    validity and latency instead of the configured order."""
+
+    def __init__(
+        self,
+        extractors: list[Extractor],
+        mode: str = config.extractor_mode,
+        timeout: float = config.extractor_timeout,
+        min_calls: int = config.extractor_min_calls,
+    ):
+        if not extractors:
+            raise ValueError("At least one extractor is required")
+        if mode not in ("fallback", "race"):
+            raise ValueError(f"Unknown extractor mode '{mode}'")
+        self.extractors = extractors
+        self.mode = mode
+        self.timeout = timeout
+        self.min_calls = min_calls
+        self.stats = {extractor.name: ExtractorStats() for extractor in extractors}
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.extractor_max_workers, thread_name_prefix="extractor"
+        )
+
+    def ordered(self) -> list[Extractor]:
+        """Extractors in order of preference"""
+
+        def key(item: tuple[int, Extractor]):
+            position, extractor = item
+            stats = self.stats[extractor.name]
+            if extractor.fallback_only:
+                return 2, 0.0, 0.0, position
+            if stats.calls < self.min_calls:
+                return 0, 0.0, 0.0, position
+            return 1, -round(stats.validity, 1), stats.latency, position
+
+        # Backends without enough calls keep their configured position in front
+        # so they get measured
+        return [
+            extractor for _, extractor in sorted(enumerate(self.extractors), key=key)
+        ]
+
+    def _run(self, extractor: Extractor, reference_text: str) -> dict:
+        start = time.monotonic()
+        try:
+            response = extractor.extract(reference_text)
+        except Exception as e:
+            logger.warning(f"Extractor {extractor.name} failed: {e}")
+            response = {"error": f"{extractor.name} failed: {e}"}
+        self.stats[extractor.name].record(time.monotonic() - start, is_valid(response))
+        return response
+
+    def extract(self, reference_text: str) -> tuple[str, dict]:
+        """Return the name of the backend that answered and its response"""
+        extractors = self.ordered()
+        response: dict = {"error": "No extractor answered"}
+        name = ""
+        if self.mode == "race" and len(extractors) > 1:
+            racers, extractors = extractors[:2], extractors[2:]
+            futures = {
+                submit(self.executor, self._run, extractor, reference_text): extractor
+                for extractor in racers
+            }
+            deadline = time.monotonic() + self.timeout
+            while futures:
+                done, _ = wait(
+                    futures,
+                    timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for future in done:
+                    extractor = futures.pop(future)
+                    name, response = extractor.name, future.result()
+                    if is_valid(response):
+                        return name, response
+        for extractor in extractors:
+            future = submit(self.executor, self._run, extractor, reference_text)
+            try:
+                name, response = extractor.name, future.result(timeout=self.timeout)
+            except TimeoutError:
+                logger.warning(f"Extractor {extractor.name} timed out")
+                continue
+            if is_valid(response):
+                return name, response
+        return name, response
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "order": [extractor.name for extractor in self.ordered()],
+            "backends": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+
+_pipeline: ExtractorPipeline | None = None
+_pipeline_lock = threading.Lock()
+
+
+def get_extractors() -> ExtractorPipeline:
+    """Return the process wide extractor pipeline, creating it on first use"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = ExtractorPipeline(
+                    [build_extractor(spec) for spec in config.extractor_backends]
+                )
+    return _pipeline
@@ -0,0 +1,307 @@
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+import config
+from cache import TTLCache
+from sparql import HedgedSparql, get_sparql, sparql_string
+from upstream import UpstreamClients, get_clients
+
+logger = logging.getLogger(__name__)
+
+item_pattern = re.compile(r"Q\d+")
+
+
+class CacheIndex:
+    """Which cache entries depend on which Wikidata entities.
+
+    Entries can also depend on a volume of a journal, an item that is
+    published in that journal (P1433) with that volume (P478) can change the
+    articles found for the volume."""
+
+    def __init__(self):
+        self._entries: dict[str, set[tuple[TTLCache, object]]] = {}
+        self._volumes: dict[tuple[str, str], set[tuple[TTLCache, object]]] = {}
+        self._lock = threading.Lock()
+        self.invalidated = 0
+
+    def track(
+        self,
+        cache: TTLCache,
+        key,
+        entity_ids: Iterable[str] = (),
+        volumes: Iterable[tuple[str, str]] = (),
+    ) -> None:
+        with self._lock:
+            for entity_id in entity_ids:
+                self._entries.setdefault(entity_id, set()).add((cache, key))
+            for volume in volumes:
+                self._volumes.setdefault(volume, set()).add((cache, key))
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._entries
+
+    @property
+    def volumes(self) -> set[tuple[str, str]]:
+        with self._lock:
+            return set(self._volumes)
+
+    def _delete(self, entries: set[tuple[TTLCache, object]], reason: str) -> int:
+        deleted = sum(cache.delete(key) for cache, key in entries)
+        if deleted:
+            logger.info(f"Invalidated {deleted} cache entries for {reason}")
+        self.invalidated += deleted
+        return deleted
+
+    def invalidate(self, entity_id: str) -> int:
+        """Delete the cache entries depending on the entity,
+        return how many were still cached"""
+        with self._lock:
+            entries = self._entries.pop(entity_id, set())
+        return self._delete(entries, entity_id)
+
+    def invalidate_volume(self, journal_id: str, volume: str) -> int:
+        """Delete the cache entries depending on the volume of the journal,
+        return how many were still cached"""
+        with self._lock:
+            entries = self._volumes.pop((journal_id, volume), set())
+        return self._delete(entries, f"{journal_id} volume {volume}")
+
+    def invalidate_all_volumes(self) -> int:
+        """Delete every cache entry depending on a volume"""
+        with self._lock:
+            volumes, self._volumes = self._volumes, {}
+        entries = set().union(*volumes.values()) if volumes else set()
+        return self._delete(entries, "all volumes")
+
+    def prune(self) -> None:
+        """Forget entries that have expired from their cache"""
+        with self._lock:
+            for index in (self._entries, self._volumes):
+                for dependency in list(index):
+                    entries = {
+                        (cache, key) for cache, key in index[dependency] if key in cache
+                    }
+                    if entries:
+                        index[dependency] = entries
+                    else:
+                        del index[dependency]
+
+    def stats(self) -> dict:
+        return {
+            "entities": len(self._entries),
+            "volumes": len(self._volumes),
+            "invalidated": self.invalidated,
+        }
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[tuple[str, dict]]:
+    """Parse Server-Sent Events as sent by Wikimedia EventStreams into
+    (event id, event) pairs. Lines holding a bare JSON object are accepted
+    too, for local files, they have no event id."""
+    data: list[str] = []
+    event_id = ""
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("{"):
+            data = [line]
+            event_id = ""
+            line = ""
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+            continue
+        elif line.startswith("id:"):
+            event_id = line[3:].strip()
+            continue
+        if not line and data:
+            try:
+                yield event_id, json.loads("\n".join(data))
+            except json.JSONDecodeError:
+                logger.warning("Skipping event that is not valid JSON")
+            data = []
+            event_id = ""
+
+
+class ChangeFeedConsumer:
+    """Invalidate cache entries from the Wikidata recent changes feed.
+
+    The source is an EventStreams URL, a file with recorded events or a
+    tcp://host:port socket sending the same format. Edits to tracked entities
+    invalidate their entries directly. Edited items are also checked in
+    batches with one SPARQL query that only returns the items whose P1433
+    and P478 values match a tracked volume."""
+
+    def __init__(
+        self,
+        index: CacheIndex,
+        source: str = config.change_feed_source,
+        clients: UpstreamClients | None = None,
+        sparql: HedgedSparql | None = None,
+        batch_size: int = config.change_feed_batch_size,
+        batch_interval: float = config.change_feed_batch_interval,
+    ):
+        self.index = index
+        self.source = source
+        self.clients = clients or get_clients()
+        self.sparql = sparql or get_sparql()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.pending: set[str] = set()
+        self.last_event_id = ""
+        self.failed_checks = 0
+        self.events = 0
+        self.checked = 0
+        self._last_flush = time.monotonic()
+        self._last_prune = time.monotonic()
+        self._thread: threading.Thread | None = None
+
+    def lines(self) -> Iterator[str]:
+        if self.source.startswith(("http://", "https://")):
+            headers = {"Accept": "text/event-stream"}
+            # Resume after the last event we saw so edits made while we
+            # were disconnected are not missed
+            if self.last_event_id:
+                headers["Last-Event-ID"] = self.last_event_id
+            with self.clients.session.get(
+                self.source,
+                headers=headers,
+                stream=True,
+                # A stalled connection has to raise so run() reconnects
+                timeout=(
+                    config.upstream_connect_timeout,
+                    config.change_feed_read_timeout,
+                ),
+            ) as response:
+                response.raise_for_status()
+                yield from response.iter_lines(decode_unicode=True)
+        elif self.source.startswith("tcp://"):
+            host, _, port = self.source[len("tcp://") :].rpartition(":")
+            with socket.create_connection((host, int(port))) as sock:
+                yield from sock.makefile("r", encoding="utf-8")
+        else:
+            with open(self.source, encoding="utf-8") as file:
+                yield from file
+
+    def handle_event(self, event: dict) -> None:
+        self.events += 1
+        if event.get("wiki") != config.change_feed_wiki:
+            return
+        if event.get("type") not in ("edit", "new") or event.get("namespace") != 0:
+            return
+        entity_id = event.get("title", "")
+        if entity_id in self.index:
+            self.index.invalidate(entity_id)
+        # The item can also have been added to or moved into a tracked volume
+        if self.index.volumes and item_pattern.fullmatch(entity_id):
+            self.pending.add(entity_id)
+
+    def flush(self, force: bool = False) -> None:
+        """Check if the pending items are published in a tracked volume"""
+        due = time.monotonic() - self._last_flush >= self.batch_interval
+        if not self.pending or not (
+            force or due or len(self.pending) >= self.batch_size
+        ):
+            return
+        self._last_flush = time.monotonic()
+        pending, self.pending = list(self.pending), set()
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start : start + self.batch_size]
+            try:
+                volumes = self.published_in(batch, self.index.volumes)
+            except Exception as e:
+                logger.warning(f"Could not check edited items: {e}")
+                self.failed_checks += 1
+                # Check them again with the next flush
+                self.pending.update(pending[start:])
+                if len(self.pending) > config.change_feed_max_pending:
+                    # We cannot tell which volumes changed, so drop them all
+                    logger.warning("Too many unchecked items, invalidating volumes")
+                    self.index.invalidate_all_volumes()
+                    self.pending.clear()
+                return
+            for journal_id, volume in volumes:
+                self.index.invalidate_volume(journal_id, volume)
+
+    def published_in(
+        self, entity_ids: list[str], volumes: set[tuple[str, str]]
+    ) -> set[tuple[str, str]]:
+        """The volumes the entities are published in (P1433 and P478),
+        WDQS only returns the ones that are in volumes"""
+        if not volumes:
+            return set()
+        items = " ".join(f"wd:{entity_id}" for entity_id in entity_ids)
+        pairs = " ".join(
+            f"( wd:{journal_id} {sparql_string(volume)} )"
+            for journal_id, volume in sorted(volumes)
+        )
+        query = f"""
+        SELECT DISTINCT ?journal ?volume WHERE {{
+          VALUES ?item {{ {items} }}
+          VALUES ( ?journal ?volume ) {{ {pairs} }}
+          ?item wdt:P1433 ?journal; wdt:P478 ?volume .
+        }}
+        """
+        result = self.sparql.execute(query)
+        self.checked += len(entity_ids)
+        return {
+            (
+                binding["journal"]["value"].rsplit("/", 1)[-1],
+                binding["volume"]["value"],
+            )
+            for binding in result["results"]["bindings"]
+        }
+
+    def prune(self, force: bool = False) -> None:
+        """Forget index entries evicted or expired from the caches now and then"""
+        if (
+            force
+            or time.monotonic() - self._last_prune >= config.change_feed_prune_interval
+        ):
+            self._last_prune = time.monotonic()
+            self.index.prune()
+
+    def consume(self) -> None:
+        """Read the whole source, files end, streams run until disconnected"""
+        for event_id, event in parse_events(self.lines()):
+            self.handle_event(event)
+            if event_id:
+                self.last_event_id = event_id
+            self.flush()
+            self.prune()
+        self.flush(force=True)
+
+    def run(self) -> None:
+        if not self.source.startswith(("http://", "https://", "tcp://")):
+            self.consume()
+            return
+        while True:
+            try:
+                self.consume()
+            except Exception as e:
+                logger.warning(f"Change feed failed: {e}")
+            self.prune(force=True)
+            time.sleep(config.change_feed_reconnect_delay)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self.run, name="change-feed", daemon=True
+        )
+        self._thread.start()
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "events": self.events,
+            "pending": len(self.pending),
+            "failed_checks": self.failed_checks,
+            "last_event_id": self.last_event_id,
+            "checked": self.checked,
+            "index": self.index.stats(),
+        }
+
+
+cache_index = CacheIndex()
@@ -0,0 +1,193 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# The SamplingProfiler of the request running in this context, worker pools
+# attach their threads to it through submit()
+current_profiler: ContextVar["SamplingProfiler | None"] = ContextVar(
+    "current_profiler", default=None
+)
+
+# Python frames that mean the thread is blocked on I/O or another thread
+# rather than using the CPU, by file name and function name
+waiting_frames = {
+    "threading.py": {"wait", "_wait_for_tstate_lock", "acquire"},
+    "queue.py": {"get"},
+    "selectors.py": {"select"},
+    "socket.py": {"readinto", "create_connection", "connect", "getaddrinfo"},
+    "ssl.py": {"read", "recv_into", "do_handshake", "_real_connect"},
+    "connection.py": {"create_connection"},  # urllib3
+}
+# Frames that mean the thread waits for a worker pool (concurrent.futures)
+pool_frames = {"_base.py": {"wait", "result", "as_completed"}}
+
+
+def in_frames(frame, frames: dict[str, set[str]]) -> bool:
+    code = frame.f_code
+    return code.co_name in frames.get(os.path.basename(code.co_filename), ())
+
+
+def is_waiting(frame) -> bool:
+    return in_frames(frame, waiting_frames)
+
+
+def sample_kind(frame) -> str:
+    """'pool' when waiting on a worker pool, 'io' when blocked otherwise
+    and 'cpu' when running"""
+    caller = frame
+    for _ in range(4):
+        if caller is None:
+            break
+        if in_frames(caller, pool_frames):
+            return "pool"
+        caller = caller.f_back
+    return "io" if is_waiting(frame) else "cpu"
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def submit(executor: Executor, fn, *args) -> Future:
+    """executor.submit() that profiles the work when the caller is profiled"""
+    profiler = current_profiler.get()
+    if profiler is None:
+        return executor.submit(fn, *args)
+
+    def run():
+        with profiler.attach():
+            return fn(*args)
+
+    return executor.submit(run)
+
+
+class SamplingProfiler:
+    """Sample the stacks of the calling thread and of the pool threads doing
+    work for it while the context is active.
+
+    Samples are stored as folded stacks which flamegraph.pl, speedscope and
+    similar tools read. Each stack starts with 'cpu' when the thread was
+    running, 'io' when it was blocked on a socket or lock and 'pool' when it
+    waited for the SPARQL or extractor pools, followed by the thread name."""
+
+    def __init__(self, interval: float = config.profiling_interval):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self.ticks = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._threads: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._thread_id = 0
+        self._token = None
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._threads[self._thread_id] = "request"
+        self._token = current_profiler.set(self)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._thread = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        cpu = time.thread_time() - self._cpu_start
+        with self._lock:
+            self.cpu += cpu
+        self.wall = time.perf_counter() - self._wall_start
+        current_profiler.reset(self._token)
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    @contextmanager
+    def attach(self):
+        """Sample the current pool thread while it works for the request"""
+        thread_id = threading.get_ident()
+        # Pool threads are named like sparql_0, group them per pool
+        name = threading.current_thread().name.rsplit("_", 1)[0]
+        cpu_start = time.thread_time()
+        with self._lock:
+            self._threads[thread_id] = name
+        try:
+            yield
+        finally:
+            cpu = time.thread_time() - cpu_start
+            with self._lock:
+                self._threads.pop(thread_id, None)
+                self.cpu += cpu
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            self.ticks += 1
+            for thread_id, name in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                kind = sample_kind(frame)
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                self.samples[";".join([kind, name, *reversed(stack)])] += 1
+
+    def kind_samples(self, kind: str) -> int:
+        return sum(
+            count
+            for stack, count in self.samples.items()
+            if stack.startswith(f"{kind};")
+        )
+
+    @property
+    def io_samples(self) -> int:
+        return self.kind_samples("io")
+
+    @property
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header. The cpu time is
+        measured per thread, io and pool are estimated from the samples and
+        summed over all threads."""
+        seconds_per_tick = self.wall / self.ticks if self.ticks else 0.0
+        io = self.io_samples * seconds_per_tick
+        pool = self.kind_samples("pool") * seconds_per_tick
+        return (
+            f"wall;dur={self.wall * 1000:.1f}, "
+            f"cpu;dur={self.cpu * 1000:.1f}, "
+            f"io;dur={io * 1000:.1f}, "
+            f"pool;dur={pool * 1000:.1f}"
+        )
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+    def save(self, directory: str = "", name: str = "") -> str:
+        """Write the folded stacks to a file and return its path"""
+        directory = directory or config.profiling_dir
+        os.makedirs(directory, exist_ok=True)
+        name = name or f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{self._thread_id}"
+        path = os.path.join(directory, f"{name}.folded")
+        with open(path, "w") as file:
+            file.write(self.folded())
+        logger.info(f"Saved profile to {path}: {self.server_timing}")
+        return path
@@ -0,0 +1,139 @@
+import re
+
+import numpy as np
+
+# Byte trigrams are hashed into this many dimensions (a power of two)
+dimensions = 2**12
+non_word = re.compile(r"[^\w]+")
+leading_number = re.compile(r"\d+")
+separator = 0  # NUL never occurs in normalized text
+
+
+def normalize(text: str) -> str:
+    return " ".join(non_word.sub(" ", text.lower()).split())
+
+
+def start_page(binding: dict) -> float:
+    """The leading number of the pages like the ?start of the SPARQL
+    queries, NaN when there is none"""
+    match = leading_number.match(binding.get("pages", {}).get("value", ""))
+    return float(match.group()) if match else float("nan")
+
+
+class SparseVectors:
+    """Unit length hashed byte trigram vectors, one row per text, stored as
+    (row, column, value) triplets since each text only has a few dozen
+    trigrams out of the dimensions.
+
+    All texts are encoded into one uint8 array separated by NUL bytes and
+    the trigram codes of every position are computed at once, trigrams
+    crossing a separator are dropped."""
+
+    def __init__(self, texts: list[str]):
+        self.length = len(texts)
+        joined = "\0".join(f" {normalize(text)} " for text in texts).encode()
+        data = np.frombuffer(joined, dtype=np.uint8)
+        if len(data) < 3:
+            self.rows = self.columns = np.empty(0, dtype=np.int64)
+            self.values = np.empty(0, dtype=np.float32)
+            return
+        first, second, third = data[:-2], data[1:-1], data[2:]
+        valid = (first != separator) & (second != separator) & (third != separator)
+        codes = (
+            first.astype(np.uint32) << 16
+            | second.astype(np.uint32) << 8
+            | third.astype(np.uint32)
+        )[valid]
+        # Knuth multiplicative hashing, keep the top bits
+        hashes = (codes * np.uint32(2654435761)) >> np.uint32(
+            33 - dimensions.bit_length()
+        )
+        rows = np.cumsum(data == separator)[:-2][valid].astype(np.int64)
+        cells, counts = np.unique(
+            rows * dimensions + hashes.astype(np.int64), return_counts=True
+        )
+        self.rows = cells // dimensions
+        self.columns = cells % dimensions
+        counts = counts.astype(np.float32)
+        norms = np.sqrt(np.bincount(self.rows, weights=counts**2, minlength=len(texts)))
+        self.values = counts / norms[self.rows].astype(np.float32)
+
+    def dot(self, vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row to a dense unit vector"""
+        return np.bincount(
+            self.rows,
+            weights=self.values * vector[self.columns],
+            minlength=self.length,
+        ).astype(np.float32)
+
+    def dense(self) -> np.ndarray:
+        matrix = np.zeros((self.length, dimensions), dtype=np.float32)
+        matrix[self.rows, self.columns] = self.values
+        return matrix
+
+
+def vectorize(texts: list[str]) -> np.ndarray:
+    """Dense unit length hashed trigram vectors, one row per text"""
+    return SparseVectors(texts).dense()
+
+
+class CandidateIndex:
+    """Precomputed vectors for the titles and authors of SPARQL bindings so
+    the same listing, e.g. a cached volume, can be scored for many references.
+    Each reference only looks at the candidates in its page window."""
+
+    title_weight = 0.8
+
+    def __init__(self, bindings: list[dict]):
+        self.bindings = bindings
+        self.titles = SparseVectors(
+            [binding.get("articleLabel", {}).get("value", "") for binding in bindings]
+        )
+        self.authors = SparseVectors(
+            [
+                " ".join(
+                    binding.get(key, {}).get("value", "")
+                    for key in ("authorNames", "authorLabels")
+                )
+                for binding in bindings
+            ]
+        )
+        self.start_pages = np.array([start_page(binding) for binding in bindings])
+
+    def page_window(self, page: int, page_range: int) -> np.ndarray:
+        """Positions of the candidates starting less than page_range pages
+        before or after the page"""
+        return np.flatnonzero(np.abs(self.start_pages - page) < page_range)
+
+    def scores(self, title: str = "", authors: str = "") -> np.ndarray:
+        """Cosine similarity of every candidate to the title and authors"""
+        if not self.bindings or not (title or authors):
+            return np.zeros(len(self.bindings), dtype=np.float32)
+        title_scores = self.titles.dot(vectorize([title])[0]) if title else None
+        author_scores = self.authors.dot(vectorize([authors])[0]) if authors else None
+        if title_scores is None:
+            return author_scores
+        if author_scores is None:
+            return title_scores
+        return (
+            self.title_weight * title_scores + (1 - self.title_weight) * author_scores
+        )
+
+    def rank(
+        self, title: str = "", authors: str = "", subset: np.ndarray | None = None
+    ) -> list[dict]:
+        """Copies of the bindings, or of the ones at the subset positions,
+        ordered by score with 'score' and 'bestMatch' added in the SPARQL JSON
+        binding format"""
+        scores = self.scores(title, authors)
+        if subset is None:
+            subset = np.arange(len(self.bindings))
+        order = subset[np.argsort(-scores[subset], kind="stable")]
+        ranked = []
+        for position, index in enumerate(order):
+            binding = dict(self.bindings[index])
+            binding["score"] = {"type": "literal", "value": f"{scores[index]:.2f}"}
+            if position == 0 and scores[index] > 0:
+                binding["bestMatch"] = {"type": "literal", "value": "true"}
+            ranked.append(binding)
+        return ranked
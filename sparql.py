@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import requests
+
+import config
+from profiling import submit
+from upstream import UpstreamClients, get_clients
+
+logger = logging.getLogger(__name__)
+
+
+def sparql_string(value: str) -> str:
+    """Quote a value as a SPARQL string literal"""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class EndpointStats:
+    """Rolling latency window and error count for one SPARQL endpoint"""
+
+    def __init__(self, endpoint: str, window: int = config.sparql_latency_window):
+        self.endpoint = endpoint
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.errors = 0
+        self.requests = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float | None) -> None:
+        """Record a successful latency in seconds or None for an error"""
+        with self._lock:
+            self.requests += 1
+            if latency is None:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+
+    def win(self) -> None:
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, fraction: float) -> float | None:
+        with self._lock:
+            if len(self.latencies) < config.sparql_hedge_min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(fraction * len(latencies)))
+        return latencies[index]
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "wins": self.wins,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+class HedgedSparql:
+    """Execute SPARQL queries against a list of endpoints.
+
+    The query goes to the first endpoint. If it has not answered once the
+    hedge delay has passed, the same query is sent to the fastest of the
+    other endpoints and the first good response wins. The hedge delay is the
+    configured percentile of the primary's recent latencies so only the slow
+    tail gets a second request. An endpoint that fails is replaced by the
+    next one right away."""
+
+    def __init__(
+        self,
+        endpoints: list[str] = config.sparql_endpoints,
+        clients: UpstreamClients | None = None,
+        hedge_percentile: float = config.sparql_hedge_percentile,
+        max_workers: int = config.sparql_max_workers,
+    ):
+        if not endpoints:
+            raise ValueError("At least one SPARQL endpoint is required")
+        self.endpoints = list(endpoints)
+        self.clients = clients or get_clients()
+        self.hedge_percentile = hedge_percentile
+        self.stats = {endpoint: EndpointStats(endpoint) for endpoint in endpoints}
+        self.hedged = 0
+        self.retried = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sparql"
+        )
+
+    def hedge_delay(self, endpoint: str) -> float:
+        delay = self.stats[endpoint].percentile(self.hedge_percentile)
+        if delay is None:
+            return config.sparql_hedge_initial_delay
+        return min(
+            max(delay, config.sparql_hedge_min_delay), config.sparql_hedge_max_delay
+        )
+
+    def _post(self, endpoint: str, query: str) -> dict:
+        start = time.monotonic()
+        try:
+            response = self.clients.session.post(
+                endpoint,
+                data={"query": query},
+                headers={"Accept": "application/sparql-results+json"},
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception:
+            self.stats[endpoint].record(None)
+            raise
+        self.stats[endpoint].record(time.monotonic() - start)
+        return result
+
+    @staticmethod
+    def retry_delay(error: Exception) -> float | None:
+        """Seconds to wait before retrying after the error,
+        None if the query should not be retried"""
+        if isinstance(error, requests.HTTPError):
+            if error.response is None or error.response.status_code not in (429, 503):
+                return None
+            retry_after = error.response.headers.get("Retry-After", "")
+            delay = (
+                float(retry_after)
+                if retry_after.isdigit()
+                else config.sparql_retry_after
+            )
+        elif isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            delay = config.sparql_retry_after
+        else:
+            return None
+        return min(delay, config.sparql_retry_max_delay)
+
+    def _fallbacks(self, primary: str) -> list[str]:
+        """The other endpoints, fastest median first"""
+
+        def median(endpoint: str) -> float:
+            p50 = self.stats[endpoint].percentile(0.5)
+            return p50 if p50 is not None else float("inf")
+
+        return sorted(
+            (endpoint for endpoint in self.endpoints if endpoint != primary),
+            key=median,
+        )
+
+    def execute(self, query: str) -> dict:
+        primary = self.endpoints[0]
+        remaining = self._fallbacks(primary)
+        pending: dict[Future, str] = {
+            submit(self.executor, self._post, primary, query): primary
+        }
+        delay = self.hedge_delay(primary)
+        last_error: Exception | None = None
+        retries = 0
+        while pending:
+            done, _ = wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                # Still waiting after the hedge delay, send to the next endpoint
+                endpoint = remaining.pop(0)
+                logger.info(f"Hedging SPARQL query to {endpoint}")
+                self.hedged += 1
+                pending[submit(self.executor, self._post, endpoint, query)] = endpoint
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"SPARQL query failed on {endpoint}: {e}")
+                    last_error = e
+                    if remaining:
+                        fallback = remaining.pop(0)
+                        pending[submit(self.executor, self._post, fallback, query)] = (
+                            fallback
+                        )
+                        continue
+                    # No other endpoint is left, retry this one if it is
+                    # throttling us or could not be reached
+                    retry_after = self.retry_delay(e)
+                    if pending or retry_after is None:
+                        continue
+                    if retries >= config.sparql_max_retries:
+                        continue
+                    retries += 1
+                    self.retried += 1
+                    logger.info(
+                        f"Retrying SPARQL query on {endpoint} in {retry_after}s"
+                    )
+                    time.sleep(retry_after)
+                    pending[submit(self.executor, self._post, endpoint, query)] = (
+                        endpoint
+                    )
+                    continue
+                self.stats[endpoint].win()
+                # Not started requests are dropped, running ones finish in the
+                # background and only update the latency stats
+                for other in pending:
+                    other.cancel()
+                return result
+        raise last_error
+
+    def to_dict(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "retried": self.retried,
+            "endpoints": {
+                endpoint: stats.to_dict() for endpoint, stats in self.stats.items()
+            },
+        }
+
+
+_sparql: HedgedSparql | None = None
+_sparql_lock = threading.Lock()
+
+
+def get_sparql() -> HedgedSparql:
+    """Return the process wide SPARQL executor, creating it on first use"""
+    global _sparql
+    if _sparql is None:
+        with _sparql_lock:
+            if _sparql is None:
+                _sparql = HedgedSparql()
+    return _sparql
@@ -0,0 +1,29 @@
+import threading
+
+from admission import AdmissionControl
+
+
+def test_admits_up_to_max_in_flight():
+    admission = AdmissionControl(max_in_flight=2, max_queue=0, queue_timeout=0)
+    assert admission.acquire() is True
+    assert admission.acquire() is True
+    assert admission.acquire() is False
+    assert admission.stats()["in_flight"] == 2
+    assert admission.stats()["shed"] == 1
+    admission.release()
+    assert admission.acquire() is True
+
+
+def test_queued_request_gets_freed_slot():
+    admission = AdmissionControl(max_in_flight=1, max_queue=1, queue_timeout=5)
+    assert admission.acquire() is True
+    threading.Timer(0.05, admission.release).start()
+    assert admission.acquire() is True
+    assert admission.stats()["waiting"] == 0
+
+
+def test_queued_request_is_shed_after_timeout():
+    admission = AdmissionControl(max_in_flight=1, max_queue=1, queue_timeout=0.01)
+    assert admission.acquire() is True
+    assert admission.acquire() is False
+    assert admission.stats()["shed"] == 1
@@ -1,6 +1,12 @@
 import pytest
 from unittest.mock import patch
 
+import config
+from admission import AdmissionControl
+from cache import TTLCache
+from invalidation import CacheIndex
+from wpf import WPF
+
 
 # Mock class to simulate WPF object
 class MockWPF_without_results:
@@ -88,3 +94,107 @@ def test_search_route_without_results(client, mock_wpf_without_result):
     # assert b'The inactivation of streptomycin by cyanate' in response.data
     assert b"Example Journal" in response.data
     assert b"http://example.com/sparql-query" in response.data
+
+
+def test_status_route(client):
+    response = client.get("/status")
+    assert response.status_code == 200
+    assert "pools" in response.json["upstream"]
+
+
+def test_search_route_sheds_when_saturated(client, mock_wpf_with_result):
+    with patch("app.admission", AdmissionControl(max_in_flight=1, max_queue=0)) as ac:
+        ac.acquire()
+        response = client.get(
+            "/search", query_string={"reference_text": "uncached reference"}
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(config.admission_retry_after)
+    mock_wpf_with_result.assert_not_called()
+
+
+def test_search_route_serves_cache_when_saturated(client, mock_wpf_with_result):
+    wpf = MockWPF_with_results()
+    wpf.status = "Success, results were found"
+    with patch("app.admission", AdmissionControl(max_in_flight=1, max_queue=0)) as ac:
+        ac.acquire()
+        with patch("app.result_cache", TTLCache(maxsize=1, ttl=60)) as cache:
+            cache.set("cached reference", wpf)
+            response = client.get(
+                "/search", query_string={"reference_text": "cached reference"}
+            )
+    assert response.status_code == 200
+    assert b"The inactivation of streptomycin by cyanate" in response.data
+    mock_wpf_with_result.assert_not_called()
+
+
+def test_search_route_profiling(client, mock_wpf_with_result, monkeypatch, tmp_path):
+    monkeypatch.setattr("config.profiling_enabled", True)
+    monkeypatch.setattr("config.profiling_dir", str(tmp_path))
+    response = client.get(
+        "/search", query_string={"reference_text": "some reference", "profile": "x"}
+    )
+    assert "X-Profile-File" not in response.headers
+    monkeypatch.setattr("config.profiling_token", "secret")
+    response = client.get(
+        "/search", query_string={"reference_text": "some reference", "profile": "x"}
+    )
+    assert "X-Profile-File" not in response.headers
+    response = client.get(
+        "/search",
+        query_string={"reference_text": "some reference"},
+        headers={"X-Profile-Token": "secret"},
+    )
+    assert response.status_code == 200
+    assert "cpu;dur=" in response.headers["Server-Timing"]
+    assert response.headers["X-Profile-File"].startswith(str(tmp_path))
+
+
+def test_search_route_does_not_track_without_change_feed(client):
+    wpf = MockWPF_with_results()
+    wpf.status = "Success, results were found"
+    wpf.article_qids = ["Q79486492"]
+    wpf.journal_qid = "Q12345"
+    wpf.volume = "176"
+    with patch("app.WPF", return_value=wpf), patch(
+        "app.cache_index", CacheIndex()
+    ) as index:
+        client.get("/search", query_string={"reference_text": "untracked reference"})
+    assert index.stats()["entities"] == 0
+    assert index.stats()["volumes"] == 0
+
+
+def test_search_route_identifier_hit_without_optional_fields(client):
+    reference_text = "Nature 171, 737. doi:10.1038/171737a0"
+    wpf = WPF(reference_text=reference_text)
+    bindings = [
+        {
+            "article": {"value": "http://www.wikidata.org/entity/Q1"},
+            "articleLabel": {"value": "Molecular structure of nucleic acids"},
+            "pages": {"value": "737-738"},
+            "publicationDate": {"value": "1953-04-25T00:00:00Z"},
+        },
+        {
+            "article": {"value": "http://www.wikidata.org/entity/Q2"},
+            "articleLabel": {"value": "Q2"},
+        },
+    ]
+
+    def execute_query(self):
+        self.query_result = {"results": {"bindings": bindings}}
+        self.query_executed = True
+
+    with patch("app.WPF", return_value=wpf), patch.object(
+        WPF, "execute_query", execute_query
+    ), patch("app.result_cache", TTLCache(maxsize=1, ttl=60)):
+        response = client.get(
+            "/search", query_string={"reference_text": reference_text}
+        )
+    assert response.status_code == 200
+    assert b"Molecular structure of nucleic acids" in response.data
+    assert b"1953-04-25" in response.data
+    assert b"N/A" in response.data
+    # Neither the journal nor the volume is known for identifier hits
+    assert b"CirrusSearch" not in response.data
+    assert b'href="https://query.wikidata.org/#"' not in response.data
+    assert wpf.status == "Success, results were found by identifier"
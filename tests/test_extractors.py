@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from extractors import (
+    Extractor,
+    ExtractorPipeline,
+    RuleBasedExtractor,
+    build_extractor,
+    parse_response,
+)
+
+valid_response = {
+    "journal": "Quad. Nutr.",
+    "year": "1948",
+    "volume": "10",
+    "pages": "283",
+}
+
+
+class FakeExtractor(Extractor):
+    def __init__(self, name, response, delay=0.0):
+        self.name = name
+        self.response = response
+        self.delay = delay
+        self.calls = 0
+
+    def extract(self, reference_text):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+def test_parse_response():
+    assert parse_response('```json\n{"journal": "Nature"}\n```') == {
+        "journal": "Nature"
+    }
+    assert "error" in parse_response("I could not find a reference")
+
+
+def test_rule_based_extractor_ruffo():
+    extractor = RuleBasedExtractor()
+    assert extractor.extract("Ruffo, A. (1948). Quad. Nutr. 10, 283.") == {
+        "authors": "Ruffo, A",
+        **valid_response,
+    }
+
+
+def test_rule_based_extractor_without_year():
+    assert "error" in RuleBasedExtractor().extract("Quad. Nutr. 10, 283.")
+
+
+def test_build_extractor():
+    assert build_extractor("ddgs:claude-3-haiku").name == "ddgs:claude-3-haiku"
+    assert build_extractor("rules").name == "rules"
+
+
+def test_fallback_on_invalid_and_error():
+    broken = FakeExtractor("broken", ValueError("throttled"))
+    invalid = FakeExtractor("invalid", {"error": "Failed to parse JSON from response"})
+    good = FakeExtractor("good", valid_response)
+    pipeline = ExtractorPipeline([broken, invalid, good], mode="fallback")
+    assert pipeline.extract("") == ("good", valid_response)
+    assert pipeline.stats["broken"].valid == 0
+    assert pipeline.stats["good"].valid == 1
+
+
+def test_fallback_on_timeout():
+    slow = FakeExtractor("slow", valid_response, delay=1)
+    good = FakeExtractor("good", valid_response)
+    pipeline = ExtractorPipeline([slow, good], mode="fallback", timeout=0.05)
+    assert pipeline.extract("") == ("good", valid_response)
+
+
+def test_race_takes_first_valid():
+    slow = FakeExtractor("slow", valid_response, delay=1)
+    fast = FakeExtractor("fast", valid_response)
+    pipeline = ExtractorPipeline([slow, fast], mode="race")
+    assert pipeline.extract("")[0] == "fast"
+
+
+def test_order_follows_stats():
+    flaky = FakeExtractor("flaky", {"error": "Failed to parse JSON from response"})
+    good = FakeExtractor("good", valid_response)
+    rules = RuleBasedExtractor()
+    pipeline = ExtractorPipeline([rules, flaky, good], mode="fallback", min_calls=2)
+    assert [e.name for e in pipeline.ordered()] == ["flaky", "good", "rules"]
+    for _ in range(2):
+        pipeline.extract("")
+    assert [e.name for e in pipeline.ordered()] == ["good", "flaky", "rules"]
+
+
+def test_extractor_requires_extract():
+    with pytest.raises(TypeError):
+        Extractor()
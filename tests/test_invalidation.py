@@ -0,0 +1,241 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from cache import TTLCache
+from invalidation import CacheIndex, ChangeFeedConsumer, parse_events
+from upstream import UpstreamClients
+
+
+def edit(title, wiki="wikidatawiki"):
+    return {"wiki": wiki, "type": "edit", "namespace": 0, "title": title}
+
+
+class FakeConsumer(ChangeFeedConsumer):
+    """Answers the volume check from a dict instead of WDQS"""
+
+    def __init__(self, index, source, published):
+        super().__init__(index, source=source, clients=object(), sparql=object())
+        self.published = published
+
+    def published_in(self, entity_ids, volumes):
+        self.checked += len(entity_ids)
+        return {
+            volume
+            for entity_id in entity_ids
+            for volume in self.published.get(entity_id, [])
+            if volume in volumes
+        }
+
+
+def test_parse_events_sse_and_json_lines():
+    lines = [
+        ":ok\n",
+        "event: message\n",
+        'id: [{"offset": 1}]\n',
+        f"data: {json.dumps(edit('Q1'))}\n",
+        "\n",
+        f"{json.dumps(edit('Q2'))}\n",
+    ]
+    assert [(event_id, event["title"]) for event_id, event in parse_events(lines)] == [
+        ('[{"offset": 1}]', "Q1"),
+        ("", "Q2"),
+    ]
+
+
+def test_edit_to_tracked_entity_invalidates_entry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    index = CacheIndex()
+    cache.set("ref", "result")
+    cache.set("other", "result")
+    index.track(cache, "ref", entity_ids=["Q79486492"])
+    consumer = FakeConsumer(index, source="", published={})
+    consumer.handle_event(edit("Q79486492", wiki="commonswiki"))
+    assert "ref" in cache
+    consumer.handle_event(edit("Q79486492"))
+    assert "ref" not in cache
+    assert "other" in cache
+
+
+def test_item_added_to_tracked_volume_invalidates_entry(tmp_path):
+    cache = TTLCache(maxsize=10, ttl=60)
+    index = CacheIndex()
+    cache.set("ref", "result")
+    cache.set("other volume", "result")
+    index.track(cache, "ref", volumes=[("Q27714801", "176")])
+    index.track(cache, "other volume", volumes=[("Q27714801", "177")])
+    source = tmp_path / "recentchange.jsonl"
+    source.write_text("".join(f"{json.dumps(edit(qid))}\n" for qid in ["Q100", "Q101"]))
+    consumer = FakeConsumer(
+        index,
+        source=str(source),
+        published={"Q100": [("Q5", "176")], "Q101": [("Q27714801", "176")]},
+    )
+    consumer.run()
+    assert consumer.checked == 2
+    assert "ref" not in cache
+    assert "other volume" in cache
+    assert index.stats()["invalidated"] == 1
+
+
+def test_prune_forgets_expired_entries():
+    cache = TTLCache(maxsize=10, ttl=60)
+    index = CacheIndex()
+    index.track(cache, "expired", entity_ids=["Q1"], volumes=[("Q2", "1")])
+    index.prune()
+    assert "Q1" not in index
+    assert index.volumes == set()
+
+
+def test_consumer_prunes_evicted_entries(monkeypatch):
+    monkeypatch.setattr("config.change_feed_prune_interval", 0)
+    cache = TTLCache(maxsize=1, ttl=60)
+    index = CacheIndex()
+    for key, qid in [("first", "Q1"), ("second", "Q2")]:
+        cache.set(key, "result")
+        index.track(cache, key, entity_ids=[qid])
+    consumer = FakeConsumer(index, source="", published={})
+    consumer.prune()
+    # "first" was evicted by the LRU so its index entry is dropped
+    assert "Q1" not in index
+    assert "Q2" in index
+
+
+class FakeSparql:
+    def __init__(self, bindings):
+        self.bindings = bindings
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return {"results": {"bindings": self.bindings}}
+
+
+def test_published_in_only_asks_for_tracked_volumes():
+    sparql = FakeSparql(
+        [
+            {
+                "journal": {"value": "http://www.wikidata.org/entity/Q27714801"},
+                "volume": {"value": "176"},
+            }
+        ]
+    )
+    index = CacheIndex()
+    index.track(TTLCache(maxsize=10, ttl=60), "ref", volumes=[("Q27714801", "176")])
+    consumer = ChangeFeedConsumer(index, source="", clients=object(), sparql=sparql)
+    # Only items can be published in a volume
+    for title in ["Q100", "Q101", "Property:P31", "L1"]:
+        consumer.handle_event(edit(title))
+    assert consumer.pending == {"Q100", "Q101"}
+    volumes = consumer.published_in(["Q100", "Q101"], index.volumes)
+    assert volumes == {("Q27714801", "176")}
+    assert consumer.checked == 2
+    [query] = sparql.queries
+    assert "VALUES ?item { wd:Q100 wd:Q101 }" in query
+    assert '( wd:Q27714801 "176" )' in query
+    assert consumer.published_in(["Q100"], set()) == set()
+    assert len(sparql.queries) == 1
+
+
+class FailingConsumer(FakeConsumer):
+    def published_in(self, entity_ids, volumes):
+        raise ConnectionError("WDQS failed")
+
+
+def test_failed_check_keeps_items_pending(monkeypatch):
+    cache = TTLCache(maxsize=10, ttl=60)
+    index = CacheIndex()
+    cache.set("ref", "result")
+    index.track(cache, "ref", volumes=[("Q27714801", "176")])
+    consumer = FailingConsumer(index, source="", published={})
+    consumer.handle_event(edit("Q100"))
+    consumer.flush(force=True)
+    assert consumer.pending == {"Q100"}
+    assert consumer.failed_checks == 1
+    assert "ref" in cache
+    # Too many unchecked items drop every tracked volume instead
+    monkeypatch.setattr("config.change_feed_max_pending", 1)
+    consumer.handle_event(edit("Q101"))
+    consumer.flush(force=True)
+    assert consumer.pending == set()
+    assert "ref" not in cache
+
+
+class FakeStreamResponse:
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self._lines)
+
+
+class FakeStreamSession:
+    def __init__(self):
+        self.headers = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.headers.append(dict(headers))
+        return FakeStreamResponse(
+            ['id: [{"offset": 7}]', f"data: {json.dumps(edit('Q1'))}", ""]
+        )
+
+
+class FakeStreamClients:
+    def __init__(self):
+        self.session = FakeStreamSession()
+
+
+def test_reconnect_resumes_from_last_event_id():
+    consumer = ChangeFeedConsumer(
+        CacheIndex(), source="https://stream.example", clients=FakeStreamClients()
+    )
+    consumer.consume()
+    assert consumer.last_event_id == '[{"offset": 7}]'
+    consumer.consume()
+    session = consumer.clients.session
+    assert "Last-Event-ID" not in session.headers[0]
+    assert session.headers[1]["Last-Event-ID"] == '[{"offset": 7}]'
+
+
+def test_stalled_stream_raises_so_run_reconnects(monkeypatch):
+    monkeypatch.setattr("config.change_feed_read_timeout", 0.2)
+    server = socket.create_server(("127.0.0.1", 0))
+    stop = threading.Event()
+
+    def stall():
+        connection, _ = server.accept()
+        connection.recv(65536)
+        connection.sendall(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n\r\n"
+            + f"data: {json.dumps(edit('Q1'))}\n\n".encode()
+        )
+        # Keep the connection open without sending anything
+        stop.wait(5)
+        connection.close()
+
+    thread = threading.Thread(target=stall, daemon=True)
+    thread.start()
+    consumer = ChangeFeedConsumer(
+        CacheIndex(),
+        source=f"http://127.0.0.1:{server.getsockname()[1]}",
+        clients=UpstreamClients(),
+    )
+    start = time.monotonic()
+    with pytest.raises(requests.ConnectionError):
+        consumer.consume()
+    stop.set()
+    server.close()
+    assert time.monotonic() - start < 2
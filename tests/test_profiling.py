@@ -0,0 +1,41 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import SamplingProfiler, submit
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_waiting_and_cpu_are_separated(tmp_path):
+    with SamplingProfiler(interval=0.001) as profiler:
+        threading.Event().wait(0.05)
+        busy(0.05)
+    assert profiler.io_samples > 0
+    assert any(
+        stack.startswith("cpu;") and "busy" in stack for stack in profiler.samples
+    )
+    assert profiler.wall >= 0.1
+    assert profiler.cpu < profiler.wall
+    assert profiler.server_timing.startswith("wall;dur=")
+    path = profiler.save(directory=str(tmp_path), name="test")
+    with open(path) as file:
+        assert file.read() == profiler.folded()
+
+
+def test_pool_threads_working_for_the_request_are_sampled():
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sparql")
+    with SamplingProfiler(interval=0.001) as profiler:
+        submit(executor, busy, 0.05).result()
+    assert any(
+        stack.startswith("cpu;sparql;") and "busy" in stack
+        for stack in profiler.samples
+    )
+    assert profiler.kind_samples("pool") > 0
+    assert profiler.cpu >= 0.04
+    assert "pool;dur=" in profiler.server_timing
+    executor.shutdown()
@@ -0,0 +1,75 @@
+import numpy as np
+
+from ranking import CandidateIndex, vectorize
+
+
+def binding(qid, title, authors=""):
+    result = {
+        "article": {"value": f"http://www.wikidata.org/entity/{qid}"},
+        "articleLabel": {"value": title},
+    }
+    if authors:
+        result["authorNames"] = {"value": authors}
+    return result
+
+
+bindings = [
+    binding("Q79486492", "The inactivation of streptomycin by cyanate", "Ruffo A"),
+    binding("Q79486497", "The reduction of cozymase by sodium borohydride", "Smith J"),
+    binding("Q79486503", "Carbohydrate metabolism in higher plants; pea aldolase"),
+]
+
+
+def test_vectorize_is_unit_length():
+    vectors = vectorize(["Carbohydrate metabolism", "", "x"])
+    assert np.allclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[1].any()
+
+
+def test_rank_orders_by_title_and_flags_best_match():
+    ranked = CandidateIndex(bindings).rank(
+        title="Reduction of cozymase with sodium borohydride"
+    )
+    assert ranked[0]["article"]["value"].endswith("Q79486497")
+    assert ranked[0]["bestMatch"]["value"] == "true"
+    assert all("bestMatch" not in result for result in ranked[1:])
+    scores = [float(result["score"]["value"]) for result in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_rank_uses_authors():
+    ranked = CandidateIndex(bindings).rank(authors="A. Ruffo")
+    assert ranked[0]["article"]["value"].endswith("Q79486492")
+
+
+def test_rank_without_title_keeps_order():
+    ranked = CandidateIndex(bindings).rank()
+    assert [result["article"] for result in ranked] == [
+        result["article"] for result in bindings
+    ]
+    assert all("bestMatch" not in result for result in ranked)
+
+
+def test_scores_thousands_of_candidates():
+    many = [binding(f"Q{i}", f"Article number {i} about cyanate") for i in range(5000)]
+    scores = CandidateIndex(many).scores(title="Article number 4242 about cyanate")
+    assert scores.shape == (5000,)
+    assert int(np.argmax(scores)) == 4242
+
+
+def test_page_window_and_ranked_subset():
+    pages = ["223-228", "229", "e12", "290-291"]
+    candidates = CandidateIndex(
+        [
+            {**candidate, "pages": {"value": value}}
+            for candidate, value in zip(bindings + [bindings[0]], pages)
+        ]
+    )
+    window = candidates.page_window(230, 15)
+    assert window.tolist() == [0, 1]
+    ranked = candidates.rank(title="Reduction of cozymase", subset=window)
+    assert [result["article"] for result in ranked] == [
+        bindings[1]["article"],
+        bindings[0]["article"],
+    ]
+    assert ranked[0]["bestMatch"]["value"] == "true"
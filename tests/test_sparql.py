@@ -0,0 +1,120 @@
+import time
+
+import pytest
+import requests
+
+from sparql import HedgedSparql
+
+result = {"head": {"vars": ["article"]}, "results": {"bindings": []}}
+
+
+class FakeResponse:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def raise_for_status(self):
+        if "broken" in self.endpoint:
+            raise ConnectionError("broken endpoint")
+
+    def json(self):
+        return {**result, "endpoint": self.endpoint}
+
+
+class FakeSession:
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = []
+
+    def post(self, endpoint, **kwargs):
+        self.calls.append(endpoint)
+        time.sleep(self.delays.get(endpoint, 0))
+        return FakeResponse(endpoint)
+
+
+class FakeClients:
+    def __init__(self, delays):
+        self.session = FakeSession(delays)
+
+
+def test_primary_answers_without_hedge():
+    clients = FakeClients({})
+    sparql = HedgedSparql(
+        endpoints=["https://primary", "https://mirror"], clients=clients
+    )
+    assert sparql.execute("SELECT")["endpoint"] == "https://primary"
+    assert clients.session.calls == ["https://primary"]
+    assert sparql.hedged == 0
+
+
+def test_slow_primary_is_hedged(monkeypatch):
+    monkeypatch.setattr("config.sparql_hedge_initial_delay", 0.05)
+    clients = FakeClients({"https://primary": 1})
+    sparql = HedgedSparql(
+        endpoints=["https://primary", "https://mirror"], clients=clients
+    )
+    assert sparql.execute("SELECT")["endpoint"] == "https://mirror"
+    assert sparql.hedged == 1
+    assert sparql.stats["https://mirror"].wins == 1
+
+
+def test_failed_primary_falls_back():
+    clients = FakeClients({})
+    sparql = HedgedSparql(
+        endpoints=["https://broken", "https://mirror"], clients=clients
+    )
+    assert sparql.execute("SELECT")["endpoint"] == "https://mirror"
+    assert sparql.stats["https://broken"].errors == 1
+
+
+def test_all_endpoints_failing_raises():
+    sparql = HedgedSparql(endpoints=["https://broken"], clients=FakeClients({}))
+    with pytest.raises(ConnectionError):
+        sparql.execute("SELECT")
+
+
+def test_hedge_delay_follows_latency(monkeypatch):
+    monkeypatch.setattr("config.sparql_hedge_min_samples", 2)
+    sparql = HedgedSparql(endpoints=["https://primary"], clients=FakeClients({}))
+    for latency in [1.0, 2.0, 3.0, 4.0]:
+        sparql.stats["https://primary"].record(latency)
+    assert sparql.hedge_delay("https://primary") == 4.0
+
+
+class ThrottledSession(FakeSession):
+    """Answers 429 with Retry-After for the first requests"""
+
+    def __init__(self, throttled, retry_after="0"):
+        super().__init__({})
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+    def post(self, endpoint, **kwargs):
+        self.calls.append(endpoint)
+        if len(self.calls) <= self.throttled:
+            response = requests.Response()
+            response.status_code = 429
+            response.headers["Retry-After"] = self.retry_after
+            raise requests.HTTPError("429 Too Many Requests", response=response)
+        return FakeResponse(endpoint)
+
+
+def test_throttled_query_is_retried(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("sparql.time.sleep", sleeps.append)
+    clients = FakeClients({})
+    clients.session = ThrottledSession(throttled=2, retry_after="7")
+    sparql = HedgedSparql(endpoints=["https://primary"], clients=clients)
+    assert sparql.execute("SELECT")["endpoint"] == "https://primary"
+    assert sleeps == [7.0, 7.0]
+    assert sparql.retried == 2
+
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr("sparql.time.sleep", lambda seconds: None)
+    monkeypatch.setattr("config.sparql_max_retries", 2)
+    clients = FakeClients({})
+    clients.session = ThrottledSession(throttled=10)
+    sparql = HedgedSparql(endpoints=["https://primary"], clients=clients)
+    with pytest.raises(requests.HTTPError):
+        sparql.execute("SELECT")
+    assert len(clients.session.calls) == 3
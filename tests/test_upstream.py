@@ -0,0 +1,26 @@
+from wikibaseintegrator import wbi_helpers
+
+from upstream import UpstreamClients, get_clients
+
+
+def test_get_clients_is_shared_and_installed():
+    clients = get_clients()
+    assert get_clients() is clients
+    assert wbi_helpers.default_session is clients.session
+    assert wbi_helpers.helpers_session is clients.session
+
+
+def test_pool_configuration():
+    clients = UpstreamClients(pool_connections=3, pool_maxsize=7)
+    stats = clients.stats()
+    assert stats["pool_connections"] == 3
+    assert stats["pool_maxsize"] == 7
+    assert stats["pools"] == {}
+
+
+def test_ddgs_is_reused_with_fresh_history():
+    clients = UpstreamClients()
+    ddgs = clients.ddgs
+    ddgs._chat_messages.append({"role": "user", "content": "old prompt"})
+    assert clients.ddgs is ddgs
+    assert ddgs._chat_messages == []
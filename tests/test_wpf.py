@@ -1,7 +1,10 @@
 import logging
 from unittest import TestCase
+from unittest.mock import Mock, patch
 
 import config
+from cache import TTLCache
+from sparql import HedgedSparql
 from wpf import WPF
 
 logging.basicConfig(level=config.loglevel)
@@ -81,6 +84,159 @@ class TestWPF(TestCase):
             "        "
         )
 
+    def test_extract_identifiers(self):
+        wpf = WPF(
+            reference_text="Watson, J. D. (1953). Nature 171, 737. doi:10.1038/171737a0. PMID: 13054692."
+        )
+        wpf.extract_identifiers()
+        assert wpf.doi == "10.1038/171737A0"
+        assert wpf.pmid == "13054692"
+
+    def test_extract_identifiers_none(self):
+        wpf = WPF(reference_text="Ruffo, A. (1948). Quad. Nutr. 10, 283.")
+        wpf.extract_identifiers()
+        assert wpf.doi == ""
+        assert wpf.pmid == ""
+        assert wpf.run_identifier_lookup() is False
+
+    def test_generate_identifier_sparql_query(self):
+        wpf = WPF(reference_text="", doi="10.1038/171737A0", pmid="13054692")
+        wpf.generate_identifier_sparql_query()
+        assert (
+            'VALUES ( ?property ?identifier ) { ( wdt:P356 "10.1038/171737A0" ) '
+            '( wdt:P698 "13054692" ) }' in wpf.sparql_query
+        )
+
+    def test_rank_results(self):
+        wpf = WPF(
+            reference_text="",
+            title="Carbohydrate metabolism in higher plants",
+            query_result={
+                "head": {"vars": ["article", "articleLabel"]},
+                "results": {
+                    "bindings": [
+                        {
+                            "article": {
+                                "value": "http://www.wikidata.org/entity/Q79486492"
+                            },
+                            "articleLabel": {
+                                "value": "The inactivation of streptomycin by cyanate"
+                            },
+                        },
+                        {
+                            "article": {
+                                "value": "http://www.wikidata.org/entity/Q79486503"
+                            },
+                            "articleLabel": {
+                                "value": "Carbohydrate metabolism in higher plants; "
+                                "pea aldolase"
+                            },
+                        },
+                    ]
+                },
+            },
+        )
+        wpf.rank_results()
+        assert wpf.article_qids == ["Q79486503", "Q79486492"]
+        assert "bestMatch" in wpf.query_result["results"]["bindings"][0]
+
+    def test_run_answers_references_from_one_volume_listing(self):
+        listing = {
+            "results": {
+                "bindings": [
+                    {
+                        "article": {"value": f"http://www.wikidata.org/entity/{qid}"},
+                        "articleLabel": {"value": title},
+                        "pages": {"value": pages},
+                    }
+                    for qid, title, pages in [
+                        ("Q1", "The inactivation of streptomycin", "223-228"),
+                        ("Q2", "Carbohydrate metabolism in higher plants", "229-231"),
+                        ("Q3", "The reduction of cozymase", "284-290"),
+                    ]
+                ]
+            }
+        }
+        sparql = Mock(spec=HedgedSparql)
+        sparql.execute.return_value = listing
+
+        def run(pages: str, title: str = "") -> WPF:
+            wpf = WPF(
+                reference_text=f"Biochem. J. (1948) 43, {pages}.",
+                ai_response={
+                    "journal": "Biochem. J.",
+                    "year": "1948",
+                    "volume": "43",
+                    "pages": pages,
+                    "title": title,
+                },
+                journal_qid="Q864228",
+                sparql=sparql,
+            )
+            wpf.run()
+            return wpf
+
+        with patch("wpf.volume_cache", TTLCache(maxsize=10, ttl=60)):
+            first = run("223-228")
+            second = run("231", title="Carbohydrate metabolism")
+            third = run("290")
+        sparql.execute.assert_called_once()
+        assert "GROUP BY" in sparql.execute.call_args.args[0]
+        assert first.status == "Success, results were found"
+        # Only the articles within the page range of the start page
+        assert first.article_qids == ["Q1", "Q2"]
+        assert second.article_qids == ["Q2", "Q1"]
+        assert "bestMatch" in second.query_result["results"]["bindings"][0]
+        assert third.article_qids == ["Q3"]
+
+    def test_extract_identifiers_backslash(self):
+        wpf = WPF(reference_text='doi:10.1000/abc\\"x')
+        wpf.extract_identifiers()
+        assert wpf.doi == "10.1000/ABC"
+        wpf.generate_identifier_sparql_query()
+        assert '( wdt:P356 "10.1000/ABC" )' in wpf.sparql_query
+
+    def test_run_identifier_hit_skips_ai(self):
+        wpf = WPF(reference_text="Nature 171, 737. doi:10.1038/171737a0")
+        result = {
+            "results": {
+                "bindings": [
+                    {"article": {"value": "http://www.wikidata.org/entity/Q1"}}
+                ]
+            }
+        }
+
+        def execute_query():
+            wpf.query_result = result
+            wpf.query_executed = True
+
+        with patch.object(WPF, "execute_query", autospec=True) as execute, patch.object(
+            WPF, "ask_ai", autospec=True
+        ) as ask_ai:
+            execute.side_effect = lambda self: execute_query()
+            wpf.run()
+        ask_ai.assert_not_called()
+        assert wpf.status == "Success, results were found by identifier"
+        assert wpf.article_qids == ["Q1"]
+        assert wpf.found_by_identifier
+        # There is no journal or volume to list and the status stays
+        assert wpf.wdqs_year_volume_query_link == ""
+        assert wpf.status == "Success, results were found by identifier"
+
+    def test_run_identifier_miss_asks_ai(self):
+        for side_effect in [None, ConnectionError("WDQS is down")]:
+            wpf = WPF(reference_text="Nature 171, 737. doi:10.1038/171737a0")
+            with patch.object(
+                WPF, "execute_query", autospec=True, side_effect=side_effect
+            ), patch.object(WPF, "ask_ai", autospec=True) as ask_ai, patch.object(
+                WPF, "extract_ai_response", autospec=True
+            ), patch.object(
+                WPF, "search_journal_qid", autospec=True
+            ):
+                wpf.run()
+            ask_ai.assert_called_once()
+            assert wpf.sparql_query == ""
+
     def test_is_valid_data(self):
         wpf = WPF(
             reference_text="",
@@ -0,0 +1,106 @@
+import logging
+import threading
+
+import requests
+from duckduckgo_search import DDGS
+from requests.adapters import HTTPAdapter
+from wikibaseintegrator import wbi_helpers
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout,
+    wikibaseintegrator does not pass one to requests"""
+
+    def __init__(self, timeout: tuple[float, float], **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class UpstreamClients:
+    """Pooled keep-alive clients shared by all WPF instances and threads.
+
+    requests.Session is backed by a thread-safe urllib3 pool per host so one
+    session is shared. DDGS keeps the chat history on the instance so we keep
+    one per thread instead and clear the history before each prompt."""
+
+    def __init__(
+        self,
+        pool_connections: int = config.upstream_pool_connections,
+        pool_maxsize: int = config.upstream_pool_maxsize,
+        connect_timeout: float = config.upstream_connect_timeout,
+        read_timeout: float = config.upstream_read_timeout,
+        user_agent: str = config.user_agent,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = TimeoutHTTPAdapter(
+            timeout=self.timeout,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"User-Agent": user_agent})
+        self.user_agent = user_agent
+        self._local = threading.local()
+
+    def install(self) -> None:
+        """Make wikibaseintegrator use our pooled session for
+        search_entities() and execute_sparql_query()"""
+        wbi_helpers.default_session = self.session
+        wbi_helpers.helpers_session = self.session
+
+    @property
+    def ddgs(self) -> DDGS:
+        ddgs = getattr(self._local, "ddgs", None)
+        if ddgs is None:
+            ddgs = DDGS(timeout=int(self.timeout[1]))
+            self._local.ddgs = ddgs
+            logger.debug("Created DDGS client for this thread")
+        # Every prompt is a new conversation
+        ddgs._chat_messages = []
+        ddgs._chat_tokens_count = 0
+        return ddgs
+
+    def stats(self) -> dict:
+        """Utilisation of the connection pools per host"""
+        pools = {}
+        for key in self.adapter.poolmanager.pools.keys():
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+            }
+        return {
+            "pool_connections": self.adapter._pool_connections,
+            "pool_maxsize": self.adapter._pool_maxsize,
+            "pools": pools,
+        }
+
+
+_clients: UpstreamClients | None = None
+_clients_lock = threading.Lock()
+
+
+def get_clients() -> UpstreamClients:
+    """Return the process wide clients, creating them on first use"""
+    global _clients
+    if _clients is None:
+        with _clients_lock:
+            if _clients is None:
+                _clients = UpstreamClients()
+                _clients.install()
+    return _clients
@@ -1,17 +1,40 @@
-import json
 import logging
+import re
 from urllib.parse import quote
 
-from duckduckgo_search import DDGS
-from pydantic import BaseModel
-from wikibaseintegrator.wbi_helpers import search_entities, execute_sparql_query
+from pydantic import BaseModel, ConfigDict, Field
+from wikibaseintegrator.wbi_helpers import search_entities
+
+import config
+from cache import TTLCache
+from extractors import ExtractorPipeline, get_extractors, is_valid
+from invalidation import cache_index
+from ranking import CandidateIndex
+from sparql import HedgedSparql, get_sparql, sparql_string
 
 logger = logging.getLogger(__name__)
 
+doi_pattern = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>\\]+)", re.IGNORECASE)
+pmid_pattern = re.compile(r"\bPMID:?\s*(\d{1,9})\b", re.IGNORECASE)
+
+# Journal name in lower case -> (QID, English label)
+journal_cache = TTLCache(
+    maxsize=config.journal_cache_size, ttl=config.journal_cache_ttl
+)
+# (journal QID, year, volume) -> CandidateIndex of the articles in the volume
+volume_cache = TTLCache(maxsize=config.volume_cache_size, ttl=config.volume_cache_ttl)
+# Candidates start less than this many pages before or after the start page
+page_range = 15
+
 
 class WPF(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     reference_text: str
     ai_response: dict = {}
+    extractor: str = ""
+    title: str = ""
+    authors: str = ""
     journal_qid: str = ""
     journal_label_en: str = ""
     journal_name: str = ""
@@ -19,30 +42,23 @@ class WPF(BaseModel):
     volume: str = ""
     pages: str = ""
     start_page: str = ""
+    doi: str = ""
+    pmid: str = ""
     sparql_query: str = ""
     query_result: dict = {}
     status: str = ""
     query_executed: bool = False
+    found_by_identifier: bool = False
     wdqs_base_url: str = "https://query.wikidata.org/#"
+    # The pooled upstream clients are shared through these, search_entities()
+    # uses them because UpstreamClients.install() sets the wikibaseintegrator
+    # session
+    sparql: HedgedSparql = Field(default_factory=get_sparql, exclude=True)
+    extractors: ExtractorPipeline = Field(default_factory=get_extractors, exclude=True)
 
     def ask_ai(self):
-        ddgs = DDGS()
-        prompt = (
-            "Please extract the title, journal, year, volume, and page number from this reference in a paper "
-            "and give me the result as an one line unformatted JSON object with the keys ['title', 'journal', 'year', 'volume', 'pages'], "
-            "don't format as time, just return strings or empty strings. Copy the journal name verbatim, only output the JSON: "
-            f'"{self.reference_text}"'
-        )
-        text = ddgs.chat(
-            prompt, model="gpt-4o-mini"
-        )  # You can change the model as needed
-        text = text.replace("json", "").strip()
-        logger.debug(text)
-        try:
-            # Attempt to parse the JSON response
-            self.ai_response = json.loads(text)
-        except json.JSONDecodeError:
-            self.ai_response = {"error": "Failed to parse JSON from response"}
+        self.extractor, self.ai_response = self.extractors.extract(self.reference_text)
+        logger.debug(f"Extracted by {self.extractor}: {self.ai_response}")
         if not self.is_valid_data():
             self.status = f"Got invalid data form AI. Required fields: journal, year, volume, pages. '{self.ai_response}'"
 
@@ -70,7 +86,7 @@ class WPF(BaseModel):
           BIND ( {self.year} AS ?year ) .
           BIND ( "{self.volume}" AS ?volume ) .
           BIND ( {self.start_page} AS ?startPage ) .
-          BIND ( 15 AS ?range ) .
+          BIND ( {page_range} AS ?range ) .
 
           ?article wdt:P1433 ?journal; wdt:P478 ?volume; wdt:P304 ?pages; wdt:P577 ?publicationDate .
 
@@ -87,35 +103,119 @@ class WPF(BaseModel):
         ORDER BY ASC(xsd:integer(?start))
         """
 
+    def generate_identifier_sparql_query(self) -> None:
+        """Look up the article directly by DOI (P356) and/or PMID (P698).
+        The result has the same shape as the full query."""
+        values = []
+        if self.doi:
+            values.append(f"( wdt:P356 {sparql_string(self.doi)} )")
+        if self.pmid:
+            values.append(f"( wdt:P698 {sparql_string(self.pmid)} )")
+        if not values:
+            self.status = "Missing data."
+            return
+        self.sparql_query = f"""
+        SELECT 
+          ?article 
+          ?articleLabel 
+          ?volume 
+          ?pages 
+          ?publicationDate 
+          (GROUP_CONCAT(DISTINCT ?authorName; separator="; ") AS ?authorNames) 
+          (GROUP_CONCAT(DISTINCT ?authorLabel; separator="; ") AS ?authorLabels)
+        WHERE {{
+          VALUES ( ?property ?identifier ) {{ {" ".join(values)} }}
+          ?article ?property ?identifier .
+
+          OPTIONAL {{ ?article wdt:P478 ?volume . }}
+          OPTIONAL {{ ?article wdt:P304 ?pages . }}
+          OPTIONAL {{ ?article wdt:P577 ?publicationDate . }}
+          OPTIONAL {{ ?article wdt:P2093 ?authorName . }}  # Author name string (P2093)
+          OPTIONAL {{ ?article wdt:P50 ?author . }}       # Author (P50)
+
+          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],mul,en" . }}
+        }}
+        GROUP BY ?article ?articleLabel ?volume ?pages ?publicationDate
+        """
+
     @property
     def generate_year_volume_sparql_query(self) -> str:
-        """This is only used as a url so we don't store it in the object for now"""
+        """All articles in the volume, the listing behind the full query.
+        It is cached per volume so we don't store it in the object"""
         if (
                 not self.journal_qid
                 or not self.year
                 or not self.volume
         ):
-            self.status = "Missing data."
+            # Also read by the template, so don't touch the status
             return ""
         return f"""
-        SELECT ?article ?articleLabel ?volume ?pages ?publicationDate WHERE {{
+        SELECT 
+          ?article 
+          ?articleLabel 
+          ?volume 
+          ?pages 
+          ?publicationDate 
+          (GROUP_CONCAT(?authorName; separator="; ") AS ?authorNames) 
+          (GROUP_CONCAT(?authorLabel; separator="; ") AS ?authorLabels)
+        WHERE {{
           BIND ( wd:{self.journal_qid} AS ?journal ) .
           BIND ( {self.year} AS ?year ) .
           BIND ( "{self.volume}" AS ?volume ) .
 
           ?article wdt:P1433 ?journal; wdt:P478 ?volume; wdt:P304 ?pages; wdt:P577 ?publicationDate .
 
+          OPTIONAL {{ ?article wdt:P2093 ?authorName . }}  # Author name string (P2093)
+          OPTIONAL {{ ?article wdt:P50 ?author . }}       # Author (P50)
+
           FILTER( YEAR( ?publicationDate ) = ?year ) .
+          BIND( REPLACE( ?pages,"(\\\\d*).*","$1" ) AS ?start ) .
 
           SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],mul,en" . }}
         }}
-        ORDER BY ASC(xsd:integer(?pages))
+        GROUP BY ?article ?articleLabel ?volume ?pages ?publicationDate
+        ORDER BY ASC(xsd:integer(?start))
         """
 
     def is_valid_data(self):
         """Check if the required fields are present in the data."""
-        required_fields = ["journal", "year", "volume", "pages"]
-        return all(field in self.ai_response for field in required_fields)
+        return is_valid(self.ai_response)
+
+    def extract_identifiers(self):
+        """Find a DOI or PMID in the reference text so we can skip the AI"""
+        doi_match = doi_pattern.search(self.reference_text)
+        if doi_match:
+            # Trailing punctuation is not part of the DOI and
+            # DOIs are stored uppercase in P356 on Wikidata
+            self.doi = doi_match.group(1).rstrip(".,;:)]").upper()
+            logger.info(f"Found DOI {self.doi}")
+        pmid_match = pmid_pattern.search(self.reference_text)
+        if pmid_match:
+            self.pmid = pmid_match.group(1)
+            logger.info(f"Found PMID {self.pmid}")
+
+    def run_identifier_lookup(self) -> bool:
+        """Resolve the reference directly by identifier.
+        Returns True if the article was found."""
+        self.extract_identifiers()
+        if not self.doi and not self.pmid:
+            return False
+        self.generate_identifier_sparql_query()
+        try:
+            self.execute_query()
+        except Exception as e:
+            # The lookup is only a shortcut, the AI path can still find the article
+            logger.warning(f"Identifier lookup failed: {e}")
+            self.query_result = {}
+        if self.empty_result:
+            logger.info("No article found by identifier, falling back to the AI")
+            self.sparql_query = ""
+            self.query_result = {}
+            self.query_executed = False
+            return False
+        self.status = "Success, results were found by identifier"
+        self.found_by_identifier = True
+        return True
 
     def extract_journal_name(self):
         self.journal_name = self.ai_response.get("journal", "")
@@ -142,8 +242,17 @@ class WPF(BaseModel):
             self.status = "Got no pages from the AI"
             return
 
+    def extract_title_and_authors(self):
+        """Only used for ranking the results so they are optional"""
+        self.title = str(self.ai_response.get("title") or "")
+        authors = self.ai_response.get("authors") or ""
+        if isinstance(authors, list):
+            authors = " ".join(str(author) for author in authors)
+        self.authors = str(authors)
+
     def extract_ai_response(self):
         """Helper method to extract the data we need"""
+        self.extract_title_and_authors()
         self.extract_journal_name()
         self.extract_year()
         self.extract_volume()
@@ -160,6 +269,11 @@ class WPF(BaseModel):
 
     def search_journal_qid(self):
         if self.journal_name:
+            cached = journal_cache.get(self.journal_name.lower())
+            if cached:
+                logger.debug(f"found cached match: {cached[0]}")
+                self.journal_qid, self.journal_label_en = cached
+                return
             search_results = search_entities(
                 search_string=self.journal_name, search_type="item", dict_result=True
             )
@@ -180,24 +294,74 @@ class WPF(BaseModel):
                         logger.debug(f'found match: {result["id"]}')
                         self.journal_qid = result["id"]  # Return the QID of the journal
                         self.journal_label_en = result["label"]
+            if self.journal_qid:
+                key = self.journal_name.lower()
+                journal_cache.set(key, (self.journal_qid, self.journal_label_en))
+                # Edits to the labels or aliases of the journal can change the match
+                if config.change_feed_enabled:
+                    cache_index.track(journal_cache, key, entity_ids=[self.journal_qid])
         else:
             logger.error("no journal_name")
 
     def execute_query(self):
         """Execute the SPARQL query and return the result."""
-        result = execute_sparql_query(
-            query=self.sparql_query,
-            prefix=None,
-            endpoint=None,
-            user_agent=None,
-            max_retries=1000,
-            retry_after=60,
-        )
-        self.query_result = result
+        self.query_result = self.sparql.execute(self.sparql_query)
+        self.query_executed = True
+
+    def volume_candidates(self) -> CandidateIndex:
+        """The articles in the whole volume, fetched once and cached with their
+        vectors for every reference to the volume"""
+        key = (self.journal_qid, self.year, self.volume)
+        candidates = volume_cache.get(key)
+        if candidates is None:
+            logger.info(f"Listing {self.journal_qid} volume {self.volume}")
+            result = self.sparql.execute(self.generate_year_volume_sparql_query)
+            candidates = CandidateIndex(result["results"]["bindings"])
+            volume_cache.set(key, candidates)
+            # New articles in the volume and edits to the listed ones
+            if config.change_feed_enabled:
+                cache_index.track(
+                    volume_cache,
+                    key,
+                    entity_ids=[
+                        binding["article"]["value"].rsplit("/", 1)[-1]
+                        for binding in candidates.bindings
+                        if "article" in binding
+                    ],
+                    volumes=[(self.journal_qid, self.volume)],
+                )
+        return candidates
+
+    def execute_volume_query(self):
+        """Answer the full query from the volume listing, ranked when there
+        is a title or authors"""
+        candidates = self.volume_candidates()
+        window = candidates.page_window(int(self.start_page), page_range)
+        if self.title or self.authors:
+            bindings = candidates.rank(self.title, self.authors, window)
+        else:
+            bindings = [candidates.bindings[position] for position in window]
+        self.query_result = {"results": {"bindings": bindings}}
         self.query_executed = True
 
+    def rank_results(self):
+        """Order the results by similarity to the title and authors
+        and flag the best match"""
+        if self.empty_result or not (self.title or self.authors):
+            return
+        candidates = CandidateIndex(self.query_result["results"]["bindings"])
+        self.query_result = {
+            **self.query_result,
+            "results": {"bindings": candidates.rank(self.title, self.authors)},
+        }
+
     def run(self) -> None:
         """Run all the methods and store the status"""
+        # Step: Resolve DOI/PMID directly which is cheaper than the AI and page window
+        if not self.ai_response and not self.sparql_query:
+            if self.run_identifier_lookup():
+                return
+
         # Step: Ask the AI for the reference details
         if not self.ai_response:
             self.ask_ai()
@@ -219,10 +383,15 @@ class WPF(BaseModel):
             if not self.sparql_query:
                 self.status += " Could not generate sparql query"
 
-        # Step: Execute the SPARQL query
+        # Step: Execute the SPARQL query, one cached listing of the volume
+        # answers the full queries of all references to it
         if self.sparql_query and not self.query_result:
             logger.info("Running query and reporting status")
-            self.execute_query()
+            if self.start_page.isdigit():
+                self.execute_volume_query()
+            else:
+                self.execute_query()
+                self.rank_results()
         if self.query_executed:
             if self.empty_result:
                 self.status = "Got empty result from WDQS"
@@ -231,22 +400,24 @@ class WPF(BaseModel):
 
     @property
     def empty_result(self):
-        empty_result = {
-            "head": {
-                "vars": [
-                    "article",
-                    "articleLabel",
-                    "volume",
-                    "pages",
-                    "publicationDate",
-                ]
-            },
-            "results": {"bindings": []},
-        }
-        if not self.query_result or self.query_result == empty_result:
+        # The vars differ between the queries so we only look at the bindings
+        if not self.query_result or not self.query_result.get("results", {}).get(
+            "bindings"
+        ):
             return True
         return False
 
+    @property
+    def article_qids(self) -> list[str]:
+        """QIDs of the articles in the query result"""
+        if self.empty_result:
+            return []
+        return [
+            binding["article"]["value"].rsplit("/", 1)[-1]
+            for binding in self.query_result["results"]["bindings"]
+            if "article" in binding
+        ]
+
     @property
     def wdqs_full_query_link(self):
         if self.sparql_query:
@@ -263,4 +434,8 @@ class WPF(BaseModel):
 
     @property
     def wdqs_year_volume_query_link(self) -> str:
-        return f"{self.wdqs_base_url}{quote(self.generate_year_volume_sparql_query)}"
+        query = self.generate_year_volume_sparql_query
+        if query:
+            return f"{self.wdqs_base_url}{quote(query)}"
+        else:
+            return ""